@@ -22,6 +22,10 @@ import time
 import subprocess
 import uuid
 import argparse
+import shutil
+import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 dot_git_path = None
@@ -81,6 +85,20 @@ def anx_key_metadata_path(key):
     return dot_git_path + ".git/annex/pynex-git-annex/" + anx_key_subpath(key)
 
 
+def anx_chunk_key(key, chunksize, num):
+    # Chunk keys are named as git-annex does: KEYFIELDS-S<chunksize>-C<num>--NAME
+    fields, name = key.split("--", 1)
+    return "%s-S%d-C%d--%s" % (fields, chunksize, num, name)
+
+
+def anx_key_verify(key, fname):
+    backend, hsh = key.split("--", 1)
+    backend = backend.split("-", 1)[0]
+    if backend not in ("SHA256", "SHA256E"):
+        return True
+    return hash_file(fname) == hsh[:64]
+
+
 def anx_content_path_to_key(path):
     assert ".git/annex/objects/" in path
     return path.rsplit("/", 1)[1]
@@ -134,6 +152,23 @@ def checkout_git_annex(fname="."):
     assert res == 0
 
 
+def git_annex_file_exists(fname):
+    return subprocess.call(["git", "cat-file", "-e", "git-annex:" + fname],
+        stderr=subprocess.DEVNULL) == 0
+
+
+def checkout_git_annex_existing(fnames):
+    "Checkout those of file(s) which exist on git-annex branch, in one go"
+    if not fnames:
+        return
+    p = subprocess.Popen(["git", "cat-file", "--batch-check"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out = p.communicate("".join("git-annex:%s\n" % f for f in fnames).encode())[0]
+    existing = [f for f, l in zip(fnames, out.decode().split("\n")) if not l.endswith(" missing")]
+    for i in range(0, len(existing), 1000):
+        checkout_git_annex(" ".join(existing[i:i + 1000]))
+
+
 def open_git_annex_file(fname, mode="r"):
     return open("%s/%s" % (git_annex_tmp, fname), mode)
 
@@ -145,11 +180,19 @@ def exec_get_line(cmd):
 
 
 def commit_git_annex_file(fname, msg="update", parent="git-annex"):
-    # fname can be "." to commit entire tree
+    # fname can be "." to commit entire tree, or a list of files
     save_dir = os.getcwd()
     try:
         os.chdir(git_annex_tmp)
-        subprocess.check_call("GIT_INDEX_FILE=../git-annex.index.out git --work-tree=. add %s" % fname, shell=True)
+        if parent:
+            # Start from the current branch tree, the index may be stale after sync
+            subprocess.check_call("GIT_INDEX_FILE=../git-annex.index.out git --work-tree=. read-tree %s" % parent, shell=True)
+        if isinstance(fname, list):
+            env = dict(os.environ, GIT_INDEX_FILE="../git-annex.index.out")
+            for i in range(0, len(fname), 1000):
+                subprocess.check_call(["git", "--work-tree=.", "add"] + fname[i:i + 1000], env=env)
+        else:
+            subprocess.check_call("GIT_INDEX_FILE=../git-annex.index.out git --work-tree=. add %s" % fname, shell=True)
         tree_id = exec_get_line("GIT_INDEX_FILE=../git-annex.index.out git --work-tree=. write-tree")
         if parent:
             parent = "-p " + parent
@@ -244,6 +287,212 @@ def parse_loc_file(fname):
     return loc_map
 
 
+def record_key_location(key, uuid, present):
+    """Append location log entry for key, return its path on git-annex branch.
+    The log should be checked out beforehand."""
+    fname = anx_key_subpath(key) + ".log"
+    locfile = anx_key_metadata_path(key) + ".log"
+    ensure_dir(locfile)
+    with open(locfile, "a") as f:
+        f.write("%s %d %s\n" % (anx_timestamp(), present, uuid))
+    return fname
+
+
+SIZE_UNITS = {
+    "": 1, "b": 1,
+    "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3, "tb": 1000 ** 4,
+    "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4,
+}
+
+
+def parse_size(s):
+    s = s.strip().lower()
+    num = s.rstrip("abcdefghijklmnopqrstuvwxyz")
+    unit = s[len(num):]
+    if not num or unit not in SIZE_UNITS:
+        fatal("Invalid size: %s" % s)
+    return int(num) * SIZE_UNITS[unit]
+
+
+def parse_remote_log():
+    "Parse remote.log into a map of special remote uuid to its config."
+    remotes = {}
+    if not git_annex_file_exists("remote.log"):
+        return remotes
+    checkout_git_annex("remote.log")
+    with open_git_annex_file("remote.log") as f:
+        for l in f:
+            try:
+                uuid, fields = l.rstrip().split(" ", 1)
+                conf = dict(x.split("=", 1) for x in fields.split(" "))
+                float(conf["timestamp"][:-1])
+            except (ValueError, KeyError):
+                fatal("Malformed remote.log entry: %s" % l.rstrip())
+            if uuid in remotes:
+                if float(conf["timestamp"][:-1]) < float(remotes[uuid]["timestamp"][:-1]):
+                    continue
+            remotes[uuid] = conf
+    return remotes
+
+
+def parse_chunk_log(key):
+    """Parse key's chunk log into a map of uuid to (tstamp, chunksize, count).
+    The log should be checked out beforehand."""
+    chunk_map = {}
+    chunkfile = anx_key_metadata_path(key) + ".log.cnk"
+    if not os.path.exists(chunkfile):
+        return chunk_map
+    with open(chunkfile) as f:
+        for l in f:
+            tstamp, uuid_size, count = l.rstrip().split(" ")
+            uuid, chunksize = uuid_size.rsplit(":", 1)
+            if uuid in chunk_map and tstamp < chunk_map[uuid][0]:
+                continue
+            chunk_map[uuid] = (tstamp, int(chunksize), int(count))
+    return chunk_map
+
+
+def record_key_chunks(key, uuid, chunksize, count):
+    """Append chunk log entry for key, return its path on git-annex branch.
+    The log should be checked out beforehand."""
+    fname = anx_key_subpath(key) + ".log.cnk"
+    chunkfile = anx_key_metadata_path(key) + ".log.cnk"
+    ensure_dir(chunkfile)
+    with open(chunkfile, "a") as f:
+        f.write("%s %s:%d %d\n" % (anx_timestamp(), uuid, chunksize, count))
+    return fname
+
+
+def copy_range(src, dest, offset, size):
+    with open(src, "rb") as f_in, open(dest, "wb") as f_out:
+        f_in.seek(offset)
+        while size > 0:
+            buf = f_in.read(min(size, 65536))
+            if not buf:
+                break
+            f_out.write(buf)
+            size -= len(buf)
+
+
+def dir_remote_key_path(directory, key):
+    return directory + "/" + anx_key_subpath(key) + "/" + key
+
+
+def dir_remote_store_chunk(directory, src, key, offset, size):
+    path = dir_remote_key_path(directory, key)
+    # Chunks already in the remote are kept, so an interrupted upload
+    # resumes from the first missing chunk.
+    if os.path.isfile(path) and os.path.getsize(path) == size:
+        return
+    tmp_path = directory + "/tmp/" + key + "/" + key
+    ensure_dir(tmp_path)
+    copy_range(src, tmp_path, offset, size)
+    ensure_dir(path)
+    os.rename(tmp_path, path)
+    os.rmdir(tmp_path.rsplit("/", 1)[0])
+
+
+def dir_remote_store_key(remote_info, key, chunksize=None, jobs=1):
+    "Store key's content in a directory special remote, return number of chunks."
+    directory = remote_info["annex-directory"]
+    src = anx_key_content_path(key)
+    size = os.path.getsize(src)
+    if not chunksize:
+        dir_remote_store_chunk(directory, src, key, 0, size)
+        return 0
+
+    count = max(1, (size + chunksize - 1) // chunksize)
+    with ThreadPoolExecutor(jobs) as pool:
+        futures = []
+        for i in range(count):
+            offset = i * chunksize
+            futures.append(pool.submit(dir_remote_store_chunk, directory, src,
+                anx_chunk_key(key, chunksize, i + 1), offset, min(chunksize, size - offset)))
+        for fut in futures:
+            fut.result()
+    return count
+
+
+def dir_remote_retrieve_chunk(directory, key, dest):
+    # Completed chunks are left in .git/annex/tmp until the whole key is
+    # assembled, so an interrupted download resumes at chunk granularity.
+    if os.path.exists(dest):
+        return
+    shutil.copyfile(dir_remote_key_path(directory, key), dest + ".part")
+    os.rename(dest + ".part", dest)
+
+
+def dir_remote_retrieve_key(uuid, remote_info, key, jobs=1):
+    directory = remote_info["annex-directory"]
+    tmp_dir = dot_git_path + ".git/annex/tmp/"
+    if not os.path.isdir(tmp_dir):
+        os.makedirs(tmp_dir)
+    tmp_path = tmp_dir + key
+
+    checkout_git_annex_existing([anx_key_subpath(key) + ".log.cnk"])
+    tstamp, chunksize, count = parse_chunk_log(key).get(uuid, (None, 0, 0))
+    if not count:
+        dir_remote_retrieve_chunk(directory, key, tmp_path)
+    else:
+        chunk_keys = [anx_chunk_key(key, chunksize, i + 1) for i in range(count)]
+        with ThreadPoolExecutor(jobs) as pool:
+            futures = [pool.submit(dir_remote_retrieve_chunk, directory, k, tmp_dir + k)
+                for k in chunk_keys]
+            for fut in futures:
+                fut.result()
+        with open(tmp_path, "wb") as f_out:
+            for k in chunk_keys:
+                with open(tmp_dir + k, "rb") as f_in:
+                    shutil.copyfileobj(f_in, f_out)
+
+    # Chunks are dropped on mismatch too, so a retry refetches them
+    if count:
+        for k in chunk_keys:
+            os.remove(tmp_dir + k)
+    if not anx_key_verify(key, tmp_path):
+        os.remove(tmp_path)
+        fatal("Checksum mismatch for %s retrieved from %s" % (key, directory))
+    local_fpath = anx_key_content_path(key)
+    ensure_dir(local_fpath)
+    os.rename(tmp_path, local_fpath)
+
+
+def remote_store_key(remote_info, key, chunksize=None, jobs=1):
+    """Store key's content in a remote. Returns number of chunks stored,
+    which should be recorded in the chunk log, or 0 if unchunked."""
+    if "annex-directory" in remote_info:
+        return dir_remote_store_key(remote_info, key, chunksize, jobs)
+    remote_fpath = anx_key_content_path(key, root=remote_info["url"])
+    ensure_dir(remote_fpath)
+    shutil.copyfile(anx_key_content_path(key), remote_fpath + ".part")
+    os.rename(remote_fpath + ".part", remote_fpath)
+    return 0
+
+
+def remote_has_key(uuid, remote_info, key):
+    "Check if remote has key's content. Chunk log should be checked out beforehand."
+    if "annex-directory" not in remote_info:
+        return os.path.exists(anx_key_content_path(key, root=remote_info["url"]))
+    directory = remote_info["annex-directory"]
+    tstamp, chunksize, count = parse_chunk_log(key).get(uuid, (None, 0, 0))
+    if not count:
+        return os.path.exists(dir_remote_key_path(directory, key))
+    return all(os.path.exists(dir_remote_key_path(directory, anx_chunk_key(key, chunksize, i + 1)))
+        for i in range(count))
+
+
+def remote_retrieve_key(uuid, remote_info, key, jobs=1):
+    if "annex-directory" in remote_info:
+        dir_remote_retrieve_key(uuid, remote_info, key, jobs)
+        return remote_info["annex-directory"]
+    remote_fpath = anx_key_content_path(key, root=remote_info["url"])
+    subprocess.check_call(("cp", remote_fpath, "."))
+    local_fpath = anx_key_content_path(key)
+    ensure_dir(local_fpath)
+    os.rename(key, local_fpath)
+    return remote_info["url"]
+
+
 def cmd_add(args):
     assert_this_uuid()
     here = get_this_uuid()
@@ -378,20 +627,339 @@ def cmd_get(args):
         #print(key, locfile)
         #print(loc_map)
         for uuid, (tstamps, present) in loc_map.items():
-            assert present
+            if not present:
+                continue
             if uuid in annex_remote_map:
                 remote_info = annex_remote_map[uuid]
                 #print("Found '%s' in repo %s (remote: '%s' %s)" % (
                 #    fname, uuid, remote_info["name"], remote_info["url"]
                 #))
-                remote_fpath = anx_key_content_path(key, root=remote_info["url"])
-                subprocess.check_call(("cp", remote_fpath, "."))
-                local_fpath = anx_key_content_path(key)
-                ensure_dir(local_fpath)
-                os.rename(key, local_fpath)
+                location = remote_retrieve_key(uuid, remote_info, key, args.jobs)
                 print("Fetched '%s' from repo %s (remote: '%s' %s)" % (
-                    fname, uuid, remote_info["name"], remote_info["url"]
+                    fname, uuid, remote_info["name"], location
                 ))
+                break
+
+
+def cmd_initremote(args):
+    assert_this_uuid()
+    # remote.log and uuid.log entries are space-separated and unquoted
+    if not args.name or any(c.isspace() for c in args.name):
+        fatal("Remote name may not contain whitespace: %s" % args.name)
+    conf = {}
+    for param in args.params:
+        if "=" not in param:
+            fatal("Expected key=value parameter: %s" % param)
+        if any(c.isspace() for c in param):
+            fatal("Parameter may not contain whitespace: %s" % param)
+        key, val = param.split("=", 1)
+        conf[key] = val
+
+    if conf.get("type") != "directory":
+        fatal("Only type=directory special remotes are supported")
+    if conf.get("encryption", "none") != "none":
+        fatal("Encryption is not supported, use encryption=none")
+    if "directory" not in conf:
+        fatal("Specify directory=")
+    conf["directory"] = os.path.abspath(conf["directory"])
+    if any(c.isspace() for c in conf["directory"]):
+        fatal("Directory path may not contain whitespace: %s" % conf["directory"])
+    if not os.path.isdir(conf["directory"]):
+        fatal("Directory does not exist: %s" % conf["directory"])
+    if "chunk" in conf:
+        parse_size(conf["chunk"])
+    conf["encryption"] = "none"
+    conf["name"] = args.name
+
+    remote_uuid = str(uuid.uuid1())
+    tstamp = anx_timestamp()
+    for fname in ("remote.log", "uuid.log"):
+        if git_annex_file_exists(fname):
+            checkout_git_annex(fname)
+    with open_git_annex_file("remote.log", mode="a") as f:
+        f.write("%s %s timestamp=%s\n" % (
+            remote_uuid, " ".join("%s=%s" % x for x in sorted(conf.items())), tstamp
+        ))
+    with open_git_annex_file("uuid.log", mode="a") as f:
+        f.write("%s %s timestamp=%s\n" % (remote_uuid, args.name, tstamp))
+    commit_git_annex_file("remote.log uuid.log", msg="initremote %s" % args.name)
+
+    subprocess.check_call(["git", "config", "remote.%s.annex-uuid" % args.name, remote_uuid])
+    subprocess.check_call(["git", "config", "remote.%s.annex-directory" % args.name, conf["directory"]])
+
+
+def get_annex_remote(git_conf, remote):
+    remote_info = git_conf.get("remote", {}).get(remote)
+    if not remote_info or "annex-uuid" not in remote_info:
+        fatal("Unknown annex remote: %s" % remote)
+    remote_uuid = remote_info["annex-uuid"]
+    chunk = parse_remote_log().get(remote_uuid, {}).get("chunk")
+    chunksize = parse_size(chunk) if chunk else None
+    return remote_uuid, remote_info, chunksize
+
+
+def cmd_transferkey(args):
+    assert_this_uuid()
+    git_conf = parse_git_config()
+    remote_uuid, remote_info, chunksize = get_annex_remote(git_conf, args.to or args.from_)
+
+    if args.to:
+        if not os.path.exists(anx_key_content_path(args.key)):
+            fatal("Content of %s is not available locally" % args.key)
+        count = remote_store_key(remote_info, args.key, chunksize, args.jobs)
+        checkout_git_annex_existing([anx_key_subpath(args.key) + ".log", anx_key_subpath(args.key) + ".log.cnk"])
+        changed = [record_key_location(args.key, remote_uuid, 1)]
+        if count:
+            changed.append(record_key_chunks(args.key, remote_uuid, chunksize, count))
+    else:
+        remote_retrieve_key(remote_uuid, remote_info, args.key, args.jobs)
+        checkout_git_annex_existing([anx_key_subpath(args.key) + ".log"])
+        changed = [record_key_location(args.key, get_this_uuid(), 1)]
+    commit_git_annex_file(" ".join(changed))
+
+
+def find_annexed_files(paths):
+    out = subprocess.check_output(["git", "ls-files", "-z", "--"] + paths).decode()
+    for fname in out.split("\0"):
+        if not fname or not os.path.islink(fname):
+            continue
+        linked = os.readlink(fname)
+        if ".git/annex/objects/" in linked:
+            yield fname, anx_content_path_to_key(linked)
+
+
+def cmd_copy(args, move=False):
+    assert_this_uuid()
+    here = get_this_uuid()
+    git_conf = parse_git_config()
+    remote_uuid, remote_info, chunksize = get_annex_remote(git_conf, args.to)
+    action = "move" if move else "copy"
+
+    files = {}
+    for fname, key in find_annexed_files(args.paths):
+        if os.path.exists(fname):
+            files.setdefault(key, fname)
+
+    # Check out all location and chunk logs at once rather than one git
+    # call per key
+    checkout_git_annex_existing([anx_key_subpath(k) + ext for k in files for ext in (".log", ".log.cnk")])
+    to_send = []
+    to_drop = []
+    for key, fname in files.items():
+        locfile = anx_key_metadata_path(key) + ".log"
+        present = False
+        if os.path.exists(locfile):
+            tstamp, present = parse_loc_file(locfile).get(remote_uuid, (0, 0))
+        if not present:
+            to_send.append(key)
+        elif move and remote_has_key(remote_uuid, remote_info, key):
+            to_drop.append(key)
+
+    def transfer(key):
+        try:
+            return key, remote_store_key(remote_info, key, chunksize), None
+        except OSError as e:
+            return key, 0, e
+
+    sent = []
+    failed = False
+    with ThreadPoolExecutor(args.jobs) as pool:
+        for key, count, err in pool.map(transfer, to_send):
+            if err:
+                print("%s %s (to %s) failed: %s" % (action, files[key], args.to, err))
+                failed = True
+                continue
+            print("%s %s (to %s) ok" % (action, files[key], args.to))
+            sent.append((key, count))
+
+    # Record all location changes in a single git-annex branch commit
+    changed = []
+    for key, count in sent:
+        changed.append(record_key_location(key, remote_uuid, 1))
+        if count:
+            changed.append(record_key_chunks(key, remote_uuid, chunksize, count))
+    if move:
+        for key in to_drop:
+            print("%s %s (to %s) ok" % (action, files[key], args.to))
+        for key in [k for k, count in sent] + to_drop:
+            path = anx_key_content_path(key)
+            os.remove(path)
+            os.rmdir(path.rsplit("/", 1)[0])
+            changed.append(record_key_location(key, here, 0))
+    if changed:
+        commit_git_annex_file(sorted(set(changed)), msg="%s --to %s" % (action, args.to))
+    if failed:
+        sys.exit(1)
+
+
+def cmd_move(args):
+    cmd_copy(args, move=True)
+
+
+def compact_key_id(key):
+    # 64 bits of key's md5 are kept instead of the key string. A collision
+    # can only make an unused key look used, never the other way around.
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def get_used_refs():
+    "Refs matching annex.used-refspec (+glob:-glob:...), git-annex branches excluded"
+    refspec = exec_get_line(["git", "config", "--default", "+refs/*", "annex.used-refspec"])
+    all_refs = exec_get_line(["git", "for-each-ref", "--format=%(refname)"]).split()
+    refs = set()
+    for pat in refspec.split(":"):
+        if pat.startswith("-"):
+            refs -= set(fnmatch.filter(refs, pat[1:]))
+        else:
+            refs |= set(fnmatch.filter(all_refs, pat.lstrip("+")))
+    return sorted(r for r in refs if not r.endswith("/git-annex"))
+
+
+def iter_git_z(cmd):
+    "Stream NUL-separated entries output by a git command."
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    rest = b""
+    for buf in iter(lambda: p.stdout.read(65536), b""):
+        entries = (rest + buf).split(b"\0")
+        rest = entries.pop()
+        yield from entries
+    if p.wait():
+        raise subprocess.CalledProcessError(p.returncode, cmd)
+
+
+def get_ref_trees(refs):
+    "Resolve refs to their distinct tree ids, skipping refs without a tree."
+    if not refs:
+        return []
+    p = subprocess.Popen(["git", "cat-file", "--batch-check=%(objectname)"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out = p.communicate("".join("%s^{tree}\n" % r for r in refs).encode())[0]
+    return sorted(set(l for l in out.decode().split("\n") if l and not l.endswith(" missing")))
+
+
+def scan_used_keys(refs):
+    """Return set of compact ids of keys referenced by annex symlinks in the
+    trees of refs and in the index."""
+    used = set()
+    errors = []
+    cat_file = subprocess.Popen(["git", "cat-file", "--batch"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        # Only trees of ref tips are scanned, like git-annex does, and only
+        # symlink (mode 120000) blobs are read. Refs sharing a tree are
+        # listed once.
+        try:
+            sources = [(["git", "ls-tree", "-r", "-z", tree], 2) for tree in get_ref_trees(refs)]
+            sources.append((["git", "ls-files", "--stage", "-z", "--", ":/"], 1))
+            for cmd, sha_field in sources:
+                for entry in iter_git_z(cmd):
+                    if entry.startswith(b"120000 "):
+                        cat_file.stdin.write(entry.split(None, 3)[sha_field] + b"\n")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            cat_file.stdin.close()
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    while True:
+        header = cat_file.stdout.readline()
+        if not header:
+            break
+        size = int(header.split()[2])
+        data = cat_file.stdout.read(size + 1)[:-1]
+        if b".git/annex/objects/" in data and b"\n" not in data:
+            used.add(compact_key_id(data.rsplit(b"/", 1)[1].decode()))
+    feeder.join()
+    cat_file.wait()
+    # An incomplete scan would make used keys look unused
+    if errors:
+        fatal("Scanning for used keys failed: %s" % errors[0])
+    return used
+
+
+def iter_annex_objects():
+    root = dot_git_path + ".git/annex/objects"
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as it1:
+        for d1 in it1:
+            if not d1.is_dir():
+                continue
+            with os.scandir(d1.path) as it2:
+                for d2 in it2:
+                    if not d2.is_dir():
+                        continue
+                    with os.scandir(d2.path) as it3:
+                        for d3 in it3:
+                            if os.path.isfile(d3.path + "/" + d3.name):
+                                yield d3.name
+
+
+def cmd_unused(args):
+    assert_this_uuid()
+    refs = get_used_refs()
+    print("unused . (checking %d refs...)" % len(refs))
+    used = scan_used_keys(refs)
+    unused = sorted(key for key in iter_annex_objects() if compact_key_id(key) not in used)
+
+    with open(dot_git_path + ".git/annex/unused", "w") as f:
+        for i, key in enumerate(unused, 1):
+            f.write("%d %s\n" % (i, key))
+
+    if not unused:
+        print("ok")
+        return
+    print("  Some annexed data is no longer used by any files:")
+    print("    NUMBER  KEY")
+    for i, key in enumerate(unused, 1):
+        print("    %-7d %s" % (i, key))
+    print("  (To see where data was previously used, try: git log --stat -S'KEY')")
+    print()
+    print("  To remove unwanted data: git-pynex dropunused NUMBER")
+
+
+def cmd_dropunused(args):
+    assert_this_uuid()
+    here = get_this_uuid()
+    unused_map = {}
+    try:
+        with open(dot_git_path + ".git/annex/unused") as f:
+            for l in f:
+                num, key = l.rstrip().split(" ", 1)
+                unused_map[int(num)] = key
+    except FileNotFoundError:
+        fatal("Run git-pynex unused first")
+
+    nums = set()
+    for spec in args.numbers:
+        try:
+            if spec == "all":
+                nums.update(unused_map)
+            elif "-" in spec:
+                start, end = spec.split("-", 1)
+                nums.update(range(int(start), int(end) + 1))
+            else:
+                nums.add(int(spec))
+        except ValueError:
+            fatal("Invalid number or range: %s" % spec)
+    for num in sorted(nums):
+        if num not in unused_map:
+            fatal("No unused data numbered %d" % num)
+
+    keys = [unused_map[num] for num in sorted(nums)]
+    checkout_git_annex_existing([anx_key_subpath(k) + ".log" for k in keys])
+    changed = []
+    for num, key in zip(sorted(nums), keys):
+        path = anx_key_content_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+            os.rmdir(path.rsplit("/", 1)[0])
+            changed.append(record_key_location(key, here, 0))
+        print("dropunused %d ok" % num)
+    if changed:
+        commit_git_annex_file(changed, msg="dropunused")
 
 
 def cmd_init(args):
@@ -455,9 +1023,34 @@ subargp.add_argument("remote")
 subargp.set_defaults(func=cmd_sync)
 
 subargp = subparsers.add_parser("get", help="make content of annexed files available")
+subargp.add_argument("-J", "--jobs", type=int, default=1, help="number of chunks to transfer in parallel")
 subargp.add_argument("paths", nargs="+")
 subargp.set_defaults(func=cmd_get)
 
+subargp = subparsers.add_parser("initremote", help="create a special remote (type=directory)")
+subargp.add_argument("name")
+subargp.add_argument("params", nargs="*", help="type=directory directory=PATH encryption=none [chunk=SIZE]")
+subargp.set_defaults(func=cmd_initremote)
+
+subargp = subparsers.add_parser("copy", help="copy content of files to a remote")
+subargp.add_argument("--to", metavar="REMOTE", required=True)
+subargp.add_argument("-J", "--jobs", type=int, default=1, help="number of files to transfer in parallel")
+subargp.add_argument("paths", nargs="+")
+subargp.set_defaults(func=cmd_copy)
+
+subargp = subparsers.add_parser("move", help="move content of files to a remote")
+subargp.add_argument("--to", metavar="REMOTE", required=True)
+subargp.add_argument("-J", "--jobs", type=int, default=1, help="number of files to transfer in parallel")
+subargp.add_argument("paths", nargs="+")
+subargp.set_defaults(func=cmd_move)
+
+subargp = subparsers.add_parser("unused", help="look for unused file content")
+subargp.set_defaults(func=cmd_unused)
+
+subargp = subparsers.add_parser("dropunused", help="drop unused file content")
+subargp.add_argument("numbers", nargs="+", metavar="NUMBER", help="number, range (N-M) or 'all'")
+subargp.set_defaults(func=cmd_dropunused)
+
 subargp = subparsers.add_parser("resolvemerge", help="resolve merge conflicts in annexed files")
 subargp.set_defaults(func=cmd_resolvemerge)
 
@@ -479,6 +1072,14 @@ subargp = subparsers.add_parser("calclocation", help="calculates the annex locat
 subargp.add_argument("file")
 subargp.set_defaults(func=cmd_calclocation)
 
+subargp = subparsers.add_parser("transferkey", help="transfers a key from or to a remote")
+subargp.add_argument("key")
+group = subargp.add_mutually_exclusive_group(required=True)
+group.add_argument("--to", metavar="REMOTE")
+group.add_argument("--from", dest="from_", metavar="REMOTE")
+subargp.add_argument("-J", "--jobs", type=int, default=1, help="number of chunks to transfer in parallel")
+subargp.set_defaults(func=cmd_transferkey)
+
 subargp = subparsers.add_parser("git-annex-co", help="checkout git-annex branch")
 subargp.set_defaults(func=cmd_git_annex_co)
 
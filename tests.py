@@ -200,3 +200,156 @@ def test_get():
     assert read_file("file1") == "file1 data\n"
     # Should be no error
     run(GIT_PYNEX + "get file1")
+
+
+def test_directory_remote():
+    if os.path.exists("/tmp/annex-test11-dir"):
+        shutil.rmtree("/tmp/annex-test11-dir")
+    os.makedirs("/tmp/annex-test11-dir")
+    make_repo("/tmp/annex-test11")
+    make_file("file1", "0123456789" * 250)
+    run(GIT_PYNEX + "add file1")
+    run("git commit -m 'file1 added'")
+    # Whitespace can't be represented in remote.log, nothing is recorded
+    os.makedirs("/tmp/annex-test11-dir/sub dir")
+    try:
+        run(GIT_PYNEX + "initremote bad type=directory 'directory=/tmp/annex-test11-dir/sub dir' encryption=none")
+        assert False
+    except subprocess.CalledProcessError:
+        pass
+    os.rmdir("/tmp/annex-test11-dir/sub dir")
+    assert popen("git config remote.bad.annex-uuid || true") == ""
+    assert "remote.log" not in popen("git ls-tree --name-only git-annex")
+    run(GIT_PYNEX + "initremote nas type=directory directory=/tmp/annex-test11-dir encryption=none chunk=1KiB")
+    remote_uuid = popen("git config remote.nas.annex-uuid").strip()
+    assert popen("git config remote.nas.annex-directory").strip() == "/tmp/annex-test11-dir"
+
+    key = popen(GIT_PYNEX + "calckey file1").strip()
+    run(GIT_PYNEX + "transferkey -J 2 %s --to nas" % key)
+    chunks = sorted(f for _, _, files in os.walk("/tmp/annex-test11-dir") for f in files)
+    assert chunks == [
+        key.replace("--", "-S1024-C%d--" % i, 1) for i in (1, 2, 3)
+    ]
+    run("git checkout git-annex")
+    assert remote_uuid in read_file("remote.log")
+    chunk_log = [f for f in popen("git ls-files").split() if f.endswith(".log.cnk")]
+    assert read_file(chunk_log[0]).split()[1:] == [remote_uuid + ":1024", "3"]
+    run("git checkout master")
+
+    content_path = popen(GIT_PYNEX + "contentlocation %s" % key).strip()
+    os.remove(content_path)
+    assert not os.path.exists("file1")
+    run(GIT_PYNEX + "get -J 2 file1")
+    assert read_file("file1") == "0123456789" * 250
+
+
+def test_directory_remote_resume():
+    test_directory_remote()
+    key = popen(GIT_PYNEX + "calckey file1").strip()
+    content_path = popen(GIT_PYNEX + "contentlocation %s" % key).strip()
+    chunks = {f: os.path.join(d, f) for d, _, files in os.walk("/tmp/annex-test11-dir") for f in files}
+    chunk1, chunk2, chunk3 = [chunks[key.replace("--", "-S1024-C%d--" % i, 1)] for i in (1, 2, 3)]
+
+    # Interrupted upload: only the missing chunk is stored again
+    os.utime(chunk1, (1000, 1000))
+    os.remove(chunk2)
+    run(GIT_PYNEX + "transferkey %s --to nas" % key)
+    assert os.path.exists(chunk2)
+    assert os.stat(chunk1).st_mtime == 1000
+
+    # Interrupted download: chunk left in .git/annex/tmp is reused
+    good_chunk1 = read_file(chunk1)
+    os.remove(content_path)
+    os.rename(chunk1, ".git/annex/tmp/" + os.path.basename(chunk1))
+    run(GIT_PYNEX + "get file1")
+    assert read_file("file1") == "0123456789" * 250
+    assert os.listdir(".git/annex/tmp") == []
+
+    # Corrupted chunk: get fails, but succeeds once the remote is fixed
+    make_file(chunk1, good_chunk1)
+    make_file(chunk3, "x" * len(read_file(chunk3)))
+    os.remove(content_path)
+    try:
+        run(GIT_PYNEX + "get file1")
+        assert False
+    except subprocess.CalledProcessError:
+        pass
+    assert not os.path.exists("file1")
+    make_file(chunk3, ("0123456789" * 250)[2048:])
+    run(GIT_PYNEX + "get file1")
+    assert read_file("file1") == "0123456789" * 250
+
+
+def test_copy_move():
+    if os.path.exists("/tmp/annex-test12-dir"):
+        shutil.rmtree("/tmp/annex-test12-dir")
+    os.makedirs("/tmp/annex-test12-dir")
+    make_repo("/tmp/annex-test12")
+    make_file("file1", "file1 data\n")
+    make_file("file2", "file2 data\n")
+    make_file("file3", "file3 data\n")
+    run(GIT_PYNEX + "add file1 file2 file3")
+    run("git commit -m 'files added'")
+    run(GIT_PYNEX + "initremote nas type=directory directory=/tmp/annex-test12-dir encryption=none")
+
+    run(GIT_PYNEX + "copy --to nas file1")
+    ncommits = len(popen("git log --oneline git-annex").split("\n"))
+    run(GIT_PYNEX + "copy -J 2 --to nas .")
+    # file1 is skipped, file2 and file3 are recorded in a single commit
+    assert len(popen("git log --oneline git-annex").split("\n")) == ncommits + 1
+    assert popen("git show --stat --format= git-annex").count(".log ") == 2
+    assert os.path.exists("file1")
+
+    run(GIT_PYNEX + "move --to nas file1 file2")
+    assert not os.path.exists("file1")
+    assert not os.path.exists("file2")
+    assert os.path.exists("file3")
+    run(GIT_PYNEX + "get file2")
+    assert read_file("file2") == "file2 data\n"
+    # Already in the remote, only local content is dropped
+    assert popen(GIT_PYNEX + "move --to nas file2") == "move file2 (to nas) ok\n"
+    assert not os.path.exists("file2")
+
+
+def test_unused():
+    make_repo("/tmp/annex-test13")
+    make_file("file1", "file1 data\n")
+    make_file("file2", "file2 data\n")
+    run(GIT_PYNEX + "add file1 file2")
+    run("git commit -m 'files added'")
+    key2 = popen(GIT_PYNEX + "calckey file2").strip()
+    run("git rm -q file2")
+    # A regular file which happens to look like an annex symlink is not a reference
+    make_file("notalink", os.readlink("file1").replace(popen(GIT_PYNEX + "calckey file1").strip(), key2))
+    run("git add notalink")
+    run("git commit -m 'file2 removed'")
+    # Only staged, but still used
+    make_file("file3", "file3 data\n")
+    run(GIT_PYNEX + "add file3")
+
+    make_file(".git/annex/objects/.DS_Store", "")
+    out = popen(GIT_PYNEX + "unused")
+    assert key2 in out
+    assert read_file(".git/annex/unused") == "1 %s\n" % key2
+
+    # Refs sharing a tree are listed only once
+    for i in range(5):
+        run("git tag tag%d" % i)
+    trace = popen("GIT_TRACE=1 " + GIT_PYNEX + "unused 2>&1")
+    assert trace.count("git ls-tree") == 1
+    assert key2 in trace
+
+    for spec in ("abc", "1-"):
+        try:
+            run(GIT_PYNEX + "dropunused " + spec)
+            assert False
+        except subprocess.CalledProcessError:
+            pass
+
+    ncommits = len(popen("git log --oneline git-annex").split("\n"))
+    run(GIT_PYNEX + "dropunused all")
+    assert len(popen("git log --oneline git-annex").split("\n")) == ncommits + 1
+    assert not os.path.exists(popen(GIT_PYNEX + "contentlocation %s" % key2).strip())
+    assert os.path.exists("file1")
+    assert os.path.exists("file3")
+    assert "1 %s\n" % key2 not in popen(GIT_PYNEX + "unused")